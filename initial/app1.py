@@ -1,10 +1,14 @@
+import itertools
 import os
+import random
+import socket
 import time
 import threading
 from datetime import datetime
 from flask import Flask, jsonify, render_template_string
 from sqlalchemy import create_engine, text
-from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError, TimeoutError as PoolTimeoutError
+from psycopg2 import OperationalError as Psycopg2OperationalError
 
 # Prometheus metrics
 from prometheus_client import Gauge, Counter, generate_latest, Histogram
@@ -32,13 +36,15 @@ engine = None  # Initialize engine to None
 # Gauge for database engine status (0 = not initialized, 1 = initialized)
 DB_ENGINE_STATUS = Gauge('flask_db_engine_status', 'Status of the database engine (1=initialized, 0=not initialized)')
 
-# Counters for connection and write attempts
-DB_CONNECT_ATTEMPTS_TOTAL = Counter('flask_db_connect_attempts_total', 'Total database connection attempts', ['status', 'is_timeout'])
-DB_WRITE_ATTEMPTS_TOTAL = Counter('flask_db_write_attempts_total', 'Total database write attempts', ['status', 'is_timeout'])
+# Unlabelled counters for connection and write outcomes (timeout details go to the logs)
+DB_CONNECT_SUCCESS_TOTAL = Counter('flask_db_connect_success_total', 'Total successful database connection attempts')
+DB_CONNECT_FAILURE_TOTAL = Counter('flask_db_connect_failure_total', 'Total failed database connection attempts')
+DB_WRITE_SUCCESS_TOTAL = Counter('flask_db_write_success_total', 'Total successful database write attempts')
+DB_WRITE_FAILURE_TOTAL = Counter('flask_db_write_failure_total', 'Total failed database write attempts')
 
-# Gauges for the last successful/failed latency (in milliseconds)
-DB_CONNECT_LATENCY_MS = Gauge('flask_db_connect_latency_ms_last', 'Last database connection latency in milliseconds', ['status'])
-DB_WRITE_LATENCY_MS = Gauge('flask_db_write_latency_ms_last', 'Last database write latency in milliseconds', ['status'])
+# Exponentially weighted share of recent attempts that timed out (0.0 - 1.0)
+DB_CONNECT_TIMEOUT_RATIO = Gauge('flask_db_connect_timeout_ratio', 'EWMA of the share of database connection attempts that timed out')
+DB_WRITE_TIMEOUT_RATIO = Gauge('flask_db_write_timeout_ratio', 'EWMA of the share of database write attempts that timed out')
 
 # Histogram for distribution of latencies
 DB_CONNECT_LATENCY_HISTOGRAM = Histogram('flask_db_connect_latency_ms', 'Database connection latency histogram in ms', buckets=[1, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000])
@@ -47,6 +53,41 @@ DB_WRITE_LATENCY_HISTOGRAM = Histogram('flask_db_write_latency_ms', 'Database wr
 
 # --- End Prometheus Metrics Definitions ---
 
+# Full-jitter exponential backoff between connection retries, so pods restarting together
+# do not reconnect to PostgreSQL in lockstep.
+RETRY_BACKOFF_BASE_SECONDS = 1
+RETRY_BACKOFF_CAP_SECONDS = 30
+
+# Successful writes are logged only every LOG_EVERY_N_WRITES-th time; the counters carry the rest
+LOG_EVERY_N_WRITES = 30
+_write_counter = itertools.count()
+
+# Exceptions counted as timeouts, matched by type rather than by message text.
+# psycopg2 raises a bare OperationalError for connect timeouts and refused connections;
+# QueryCanceled (statement timeout) and ConnectionException are subclasses of it.
+# PoolTimeoutError is SQLAlchemy giving up waiting for a pooled connection.
+TIMEOUT_TYPES = (Psycopg2OperationalError, PoolTimeoutError, socket.timeout)
+
+TIMEOUT_RATIO_ALPHA = 0.1 # Weight of the newest attempt in the timeout ratio EWMA
+_timeout_ratios = {DB_CONNECT_TIMEOUT_RATIO: 0.0, DB_WRITE_TIMEOUT_RATIO: 0.0}
+
+
+def record_timeout_ratio(gauge, is_timeout):
+    """Folds one attempt into the timeout ratio EWMA exposed by the given gauge."""
+    ratio = TIMEOUT_RATIO_ALPHA * (1.0 if is_timeout else 0.0) + (1 - TIMEOUT_RATIO_ALPHA) * _timeout_ratios[gauge]
+    _timeout_ratios[gauge] = ratio
+    gauge.set(ratio)
+
+
+def is_timeout(e):
+    """Returns True if the error (or the driver error SQLAlchemy wrapped in e.orig) is a timeout."""
+    return isinstance(e, TIMEOUT_TYPES) or isinstance(getattr(e, 'orig', None), TIMEOUT_TYPES)
+
+
+def retry_backoff_delay(attempt):
+    """Returns a random delay in [0, min(cap, base * 2**attempt)] seconds."""
+    return random.uniform(0, min(RETRY_BACKOFF_CAP_SECONDS, RETRY_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
 
 def init_db_engine():
     """Initializes the database engine."""
@@ -54,48 +95,62 @@ def init_db_engine():
     retries = 5
     DB_ENGINE_STATUS.set(0) # Assume not initialized initially
     while retries > 0:
-        start_time = time.perf_counter()
+        start_ns = time.monotonic_ns()
         error_type = "unknown" # Default error type
         try:
             app.logger.info(f"Attempting to connect to database at {DB_HOST}:{DB_PORT}/{DB_NAME}...")
-            temp_engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args={"connect_timeout": 10})
+            temp_engine = create_engine(
+                DATABASE_URL,
+                pool_size=10,
+                max_overflow=20,
+                pool_timeout=5,
+                pool_recycle=1800,
+                pool_pre_ping=True,
+                connect_args={"connect_timeout": 10}
+            )
             with temp_engine.connect() as connection:
                 connection.execute(text("SELECT 1")) # Test the connection
+            # One-shot schema setup per engine; the write loop only runs the INSERT.
+            # engine.begin() commits on success and rolls back if the DDL fails.
+            with temp_engine.begin() as connection:
+                connection.execute(text("CREATE TABLE IF NOT EXISTS timestamps (id SERIAL PRIMARY KEY, recorded_at TIMESTAMP NOT NULL);"))
+            if engine is not None:
+                engine.dispose() # Close the replaced engine's pooled connections instead of leaving them to GC
             engine = temp_engine # Assign only if successful
-            latency_ms = (time.perf_counter() - start_time) * 1000
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
             DB_ENGINE_STATUS.set(1)
-            DB_CONNECT_ATTEMPTS_TOTAL.labels(status='success', is_timeout='false').inc()
-            DB_CONNECT_LATENCY_MS.labels(status='success').set(latency_ms)
+            DB_CONNECT_SUCCESS_TOTAL.inc()
+            record_timeout_ratio(DB_CONNECT_TIMEOUT_RATIO, False)
             DB_CONNECT_LATENCY_HISTOGRAM.observe(latency_ms)
             app.logger.info("Database connection established successfully.")
             break
         except (SQLAlchemyError, DBAPIError) as e:
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            is_timeout_error = "timed out" in str(e).lower() or "connection refused" in str(e).lower()
-            timeout_label = 'true' if is_timeout_error else 'false'
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+            is_timeout_error = is_timeout(e)
 
-            DB_CONNECT_ATTEMPTS_TOTAL.labels(status='failure', is_timeout=timeout_label).inc()
-            DB_CONNECT_LATENCY_MS.labels(status='failure').set(latency_ms)
+            DB_CONNECT_FAILURE_TOTAL.inc()
+            record_timeout_ratio(DB_CONNECT_TIMEOUT_RATIO, is_timeout_error)
             DB_CONNECT_LATENCY_HISTOGRAM.observe(latency_ms) # Even failed attempts have latency
-            
-            app.logger.error(f"Error connecting to database: {e}")
+
+            app.logger.error(f"Error connecting to database (is_timeout={is_timeout_error}, latency_ms={latency_ms:.1f}): {e}")
             retries -= 1
             if retries > 0:
-                app.logger.info(f"Retrying database connection in 5 seconds... ({retries} attempts left)")
-                time.sleep(5)
+                delay = retry_backoff_delay(5 - retries)
+                app.logger.info(f"Retrying database connection in {delay:.1f} seconds... ({retries} attempts left)")
+                time.sleep(delay)
             else:
                 app.logger.error("Failed to connect to database after multiple retries. Engine will remain None.")
                 engine = None # Ensure engine is None if all retries fail
                 DB_ENGINE_STATUS.set(0)
                 break
         except Exception as e: # Catch any other unexpected errors
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            DB_CONNECT_ATTEMPTS_TOTAL.labels(status='failure', is_timeout='false').inc() # Treat as non-timeout failure
-            DB_CONNECT_LATENCY_MS.labels(status='failure').set(latency_ms)
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+            DB_CONNECT_FAILURE_TOTAL.inc()
+            record_timeout_ratio(DB_CONNECT_TIMEOUT_RATIO, False) # Treat as non-timeout failure
             DB_CONNECT_LATENCY_HISTOGRAM.observe(latency_ms)
-            app.logger.error(f"An unexpected error occurred during DB initialization: {e}")
+            app.logger.error(f"An unexpected error occurred during DB initialization (is_timeout=False, latency_ms={latency_ms:.1f}): {e}")
             retries -= 1
-            time.sleep(5)
+            time.sleep(retry_backoff_delay(5 - retries))
 
 def write_timestamp_to_db():
     """Continuously writes the current timestamp to the database."""
@@ -107,35 +162,33 @@ def write_timestamp_to_db():
                 time.sleep(5) # Wait before trying again
                 continue
 
-        start_time = time.perf_counter()
+        start_ns = time.monotonic_ns()
         try:
-            with engine.connect() as connection:
-                connection.execute(text("CREATE TABLE IF NOT EXISTS timestamps (id SERIAL PRIMARY KEY, recorded_at TIMESTAMP NOT NULL);"))
-                connection.execute(text("INSERT INTO timestamps (recorded_at) VALUES (:timestamp);"), {"timestamp": datetime.now()})
+            current_time = datetime.now() # Read the clock once and reuse it for the INSERT and the log line
+            with engine.connect() as connection: # Checks out a pooled connection
+                connection.execute(text("INSERT INTO timestamps (recorded_at) VALUES (:timestamp);"), {"timestamp": current_time})
                 connection.commit()
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            DB_WRITE_ATTEMPTS_TOTAL.labels(status='success', is_timeout='false').inc()
-            DB_WRITE_LATENCY_MS.labels(status='success').set(latency_ms)
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+            DB_WRITE_SUCCESS_TOTAL.inc()
+            record_timeout_ratio(DB_WRITE_TIMEOUT_RATIO, False)
             DB_WRITE_LATENCY_HISTOGRAM.observe(latency_ms)
-            app.logger.info(f"Timestamp recorded: {datetime.now()}")
+            if next(_write_counter) % LOG_EVERY_N_WRITES == 0:
+                app.logger.info("Timestamp recorded: %s", current_time)
         except (SQLAlchemyError, DBAPIError) as e:
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            is_timeout_error = "timed out" in str(e).lower() or "connection refused" in str(e).lower()
-            timeout_label = 'true' if is_timeout_error else 'false'
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+            is_timeout_error = is_timeout(e)
 
-            DB_WRITE_ATTEMPTS_TOTAL.labels(status='failure', is_timeout=timeout_label).inc()
-            DB_WRITE_LATENCY_MS.labels(status='failure').set(latency_ms)
+            DB_WRITE_FAILURE_TOTAL.inc()
+            record_timeout_ratio(DB_WRITE_TIMEOUT_RATIO, is_timeout_error)
             DB_WRITE_LATENCY_HISTOGRAM.observe(latency_ms)
-            app.logger.error(f"Error writing timestamp to database: {e}")
-            # Re-initialize engine on error, as connection might be stale
-            init_db_engine()
+            app.logger.error(f"Error writing timestamp to database (is_timeout={is_timeout_error}, latency_ms={latency_ms:.1f}): {e}")
+            # The engine is kept: pool_pre_ping replaces stale connections on the next checkout
         except Exception as e:
-            latency_ms = (time.perf_counter() - start_time) * 1000
-            DB_WRITE_ATTEMPTS_TOTAL.labels(status='failure', is_timeout='false').inc()
-            DB_WRITE_LATENCY_MS.labels(status='failure').set(latency_ms)
+            latency_ms = (time.monotonic_ns() - start_ns) / 1_000_000
+            DB_WRITE_FAILURE_TOTAL.inc()
+            record_timeout_ratio(DB_WRITE_TIMEOUT_RATIO, False)
             DB_WRITE_LATENCY_HISTOGRAM.observe(latency_ms)
-            app.logger.error(f"An unexpected error occurred during DB write: {e}")
-            init_db_engine()
+            app.logger.error(f"An unexpected error occurred during DB write (is_timeout=False, latency_ms={latency_ms:.1f}): {e}")
         finally:
             time.sleep(2) # Wait for 2 seconds before the next write
 
@@ -155,11 +208,23 @@ def health_check():
             return jsonify({"status": "unhealthy", "database_connection": f"failed: {e}"}), 500
     return jsonify({"status": "unhealthy", "database_connection": "engine not initialized"}), 500
 
+# Rendered /metrics body, reused for _METRICS_CACHE_TTL seconds so back-to-back scrapes
+# do not each walk and format every series.
+_METRICS_CACHE = {"body": b"", "ts": float('-inf')}
+_METRICS_CACHE_TTL = 1.0
+_METRICS_CACHE_LOCK = threading.Lock()
+
 @app.route('/metrics')
 def metrics():
     """Exposes Prometheus metrics."""
     # Ensure this endpoint doesn't block the background thread
-    return generate_latest(), 200, {'Content-Type': prometheus_client.CONTENT_TYPE_LATEST}
+    with _METRICS_CACHE_LOCK:
+        now = time.monotonic()
+        if now - _METRICS_CACHE["ts"] > _METRICS_CACHE_TTL:
+            _METRICS_CACHE["body"] = generate_latest()
+            _METRICS_CACHE["ts"] = now
+        body = _METRICS_CACHE["body"]
+    return body, 200, {'Content-Type': prometheus_client.CONTENT_TYPE_LATEST}
 
 
 # The /stats endpoint is now deprecated in favor of /metrics for machine consumption
@@ -168,11 +233,23 @@ def metrics():
 def stats_deprecated():
     return "Please use /metrics for machine-readable statistics for Grafana.", 404
 
-if __name__ == '__main__':
+# The app is served by gunicorn (see gunicorn_app1.conf.py), which calls start_background_tasks()
+# once in its worker after the app is loaded.
+_BG_LOCK = threading.Lock()
+
+
+def start_background_tasks():
+    """
+    Initializes the DB engine, then starts the background timestamp writer thread.
+    Safe to call more than once; only the first call does anything.
+    """
+    with _BG_LOCK:
+        if app.config.get('_BG_STARTED'):
+            return
+        app.config['_BG_STARTED'] = True
+
     # Initialize DB engine before starting the background thread
     init_db_engine()
-    timestamp_thread = threading.Thread(target=write_timestamp_to_db)
+    timestamp_thread = threading.Thread(target=write_timestamp_to_db, name="timestamp-writer")
     timestamp_thread.daemon = True
     timestamp_thread.start()
-
-    app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,28 @@
+# gunicorn_app1.conf.py
+
+# Gunicorn settings for app1.py (SQLAlchemy writer).
+# Usage: gunicorn -c gunicorn_app1.conf.py app1:app
+# Not named gunicorn.conf.py, which gunicorn would pick up automatically when serving app.py.
+
+bind = '0.0.0.0:8080'
+
+# A single worker process: the background writer and the Prometheus metrics live in
+# process memory, so more workers would duplicate writes and split the counters
+# between processes. Threads let /metrics and / be served while the writer is busy.
+workers = 1
+worker_class = 'gthread'
+threads = 8
+
+# Import the app once in the master so configuration errors fail fast at startup.
+# The engine is only created in start_background_tasks(), after the fork.
+preload_app = True
+
+# Directs access logs to stdout and error logs to stderr
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Starts the database writer thread inside the worker, after the fork."""
+    from app1 import start_background_tasks
+    start_background_tasks()
@@ -1,10 +1,14 @@
 # app.py
 
+import io
+import itertools
 import os
+import random
 import time
 import threading
 import json # Still needed for logging/debugging JSON representation, but not for parsing main config
-from datetime import datetime
+from collections import defaultdict, deque
+from typing import NamedTuple
 import logging
 
 from flask import Flask, Response
@@ -12,6 +16,7 @@ from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_
 
 # --- PostgreSQL Import ---
 import psycopg2
+from psycopg2.extras import execute_values
 from psycopg2 import OperationalError as Psycopg2OperationalError
 
 
@@ -27,6 +32,23 @@ app.logger.setLevel(logging.INFO)
 # Example: DATABASE_NAMES="db1,db2,my_analytics_db"
 DATABASE_NAMES_STR = os.getenv('DATABASE_NAMES')
 
+class DbConfig(NamedTuple):
+    """
+    Connection settings for one logical database.
+    A NamedTuple keeps instances small and immutable with plain attribute access.
+    """
+    name: str
+    host: str
+    port: str
+    user: str
+    password: str
+    dbname: str
+
+    def __repr__(self):
+        # Keep the password out of logs and tracebacks
+        return f"DbConfig(name={self.name!r}, host={self.host!r}, port={self.port!r}, user={self.user!r}, dbname={self.dbname!r})"
+
+
 # List to hold parsed database configurations
 DB_CONFIGS = []
 
@@ -40,23 +62,22 @@ if DATABASE_NAMES_STR:
         # Convert logical name to uppercase for environment variable lookup convention
         env_prefix = db_logical_name.upper()
 
-        db_config = {
-            'name': db_logical_name, # Use the original logical name for the 'name' field
-            'host': os.getenv(f'{env_prefix}_DB_HOST'),
+        db_config = DbConfig(
+            name=db_logical_name, # Use the original logical name for the 'name' field
+            host=os.getenv(f'{env_prefix}_DB_HOST'),
             # Hardcode default port to 5432, but allow override from environment variable
-            'port': os.getenv(f'{env_prefix}_DB_PORT', '5432'),
+            port=os.getenv(f'{env_prefix}_DB_PORT', '5432'),
             # Hardcode default user to 'k8sadmin', but allow override from environment variable
-            'user': os.getenv(f'{env_prefix}_DB_USER', 'k8sadmin'),
-            'password': os.getenv(f'{env_prefix}_DB_PASSWORD'),
+            user=os.getenv(f'{env_prefix}_DB_USER', 'k8sadmin'),
+            password=os.getenv(f'{env_prefix}_DB_PASSWORD'),
             # Hardcode default dbname to 'timestamps', but allow override from environment variable
-            'dbname': os.getenv(f'{env_prefix}_DB_DBNAME', 'timestamp')
-        }
+            dbname=os.getenv(f'{env_prefix}_DB_DBNAME', 'timestamp')
+        )
 
         # Validate essential PostgreSQL connection parameters.
         # 'host' and 'password' are now mandatory.
         # 'port', 'user', and 'dbname' now have defaults.
-        required_keys = ['host', 'password']
-        if not all(db_config.get(key) for key in required_keys):
+        if not (db_config.host and db_config.password):
             app.logger.error(f"ERROR: Missing one or more required environment variables for database '{db_logical_name}'. Expected: "
                              f"'{env_prefix}_DB_HOST', '{env_prefix}_DB_PASSWORD'. "
                              f"'PORT', 'USER', and 'DBNAME' have defaults but can be overridden. Exiting.")
@@ -67,6 +88,14 @@ else:
     app.logger.error("ERROR: DATABASE_NAMES environment variable not set. Please provide a comma-separated list of logical database names. Exiting.")
     exit(1)
 
+# Every metric below carries a 'database_name' label, so each configured database adds a full
+# set of series (including one per histogram bucket). Cap the list to keep cardinality bounded.
+MAX_DATABASES = 20
+if len(DB_CONFIGS) > MAX_DATABASES:
+    app.logger.error(f"ERROR: DATABASE_NAMES lists {len(DB_CONFIGS)} databases, but at most {MAX_DATABASES} are supported "
+                     f"to keep the 'database_name' metric label cardinality bounded. Exiting.")
+    exit(1)
+
 # Read write interval from environment variable, default to 5 seconds.
 try:
     DB_WRITE_INTERVAL_SECONDS = int(os.getenv('DB_WRITE_INTERVAL_SECONDS', 5))
@@ -74,6 +103,24 @@ except ValueError:
     app.logger.warning("DB_WRITE_INTERVAL_SECONDS environment variable is not an integer. Using default 5 seconds.")
     DB_WRITE_INTERVAL_SECONDS = 5
 
+# Read once at startup; the writer checks this on every tick.
+SIMULATE_FAILURE = os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true'
+
+# Timestamps are buffered per database and flushed once DB_WRITE_BATCH_SIZE rows are pending
+# or DB_FLUSH_INTERVAL_SECONDS have passed since the last flush, whichever comes first.
+# The flush interval defaults to the write interval, i.e. one flush per tick.
+try:
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 50))
+except ValueError:
+    app.logger.warning("DB_WRITE_BATCH_SIZE environment variable is not an integer. Using default 50 rows.")
+    DB_WRITE_BATCH_SIZE = 50
+
+try:
+    DB_FLUSH_INTERVAL_SECONDS = int(os.getenv('DB_FLUSH_INTERVAL_SECONDS', DB_WRITE_INTERVAL_SECONDS))
+except ValueError:
+    app.logger.warning(f"DB_FLUSH_INTERVAL_SECONDS environment variable is not an integer. Using the write interval ({DB_WRITE_INTERVAL_SECONDS} seconds).")
+    DB_FLUSH_INTERVAL_SECONDS = DB_WRITE_INTERVAL_SECONDS
+
 # --- Prometheus Metrics Initialization ---
 DB_WRITE_LATENCY = Histogram(
     'multidb_write_latency_seconds',
@@ -106,22 +153,20 @@ def get_db_connection(db_config):
     """
     Establishes and returns a PostgreSQL database connection using the provided config.
     """
-    db_name = db_config['dbname']
-    db_user = db_config['user']
-    db_password = db_config['password']
-    db_host = db_config['host']
-    db_port = db_config['port']
-    logical_db_name = db_config['name']
-
+    logical_db_name = db_config.name
     try:
-        app.logger.info(f"Connecting to PostgreSQL database: {db_user}@tcp({db_host}:{db_port})/{db_name} (Logical Name: {logical_db_name})")
+        app.logger.info(f"Connecting to PostgreSQL database: {db_config.user}@tcp({db_config.host}:{db_config.port})/{db_config.dbname} (Logical Name: {logical_db_name})")
         conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            connect_timeout=5
+            host=db_config.host,
+            port=db_config.port,
+            user=db_config.user,
+            password=db_config.password,
+            database=db_config.dbname,
+            connect_timeout=5,
+            # The writer holds its connection for the life of the process; keepalives
+            # let idle-connection drops be detected instead of hanging the next write
+            keepalives=1,
+            keepalives_idle=60
         )
         return conn
     except Psycopg2OperationalError as e:
@@ -132,77 +177,175 @@ def get_db_connection(db_config):
         raise
 
 
-def create_table(db_config):
+def create_table(db_config, cursor):
     """Creates the timestamps table if it's not present in the specified PostgreSQL database."""
-    logical_db_name = db_config['name']
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timestamps (
+            id SERIAL PRIMARY KEY,
+            timestamp TEXT NOT NULL
+        )
+    ''')
+    app.logger.info(f"Database table 'timestamps' ensured to exist in PostgreSQL database '{db_config.dbname}' (Logical Name: {db_config.name}).")
+
+
+def open_writer_connection(db_config):
+    """
+    Opens the long-lived connection used by a database's writer thread.
+    The table is ensured and the INSERT prepared once per connection, not once per write.
+    """
+    conn = get_db_connection(db_config)
     try:
-        conn = get_db_connection(db_config)
         cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS timestamps (
-                id SERIAL PRIMARY KEY,
-                timestamp TEXT NOT NULL
-            )
-        ''')
+        create_table(db_config, cursor)
+        cursor.execute("PREPARE insert_ts (text) AS INSERT INTO timestamps (timestamp) VALUES ($1)")
         conn.commit()
+    except Exception:
         conn.close()
-        app.logger.info(f"Database table 'timestamps' ensured to exist in PostgreSQL database '{db_config['dbname']}' (Logical Name: {logical_db_name}).")
-    except Exception as e:
-        app.logger.error(f"Error creating database table in PostgreSQL for '{logical_db_name}': {e}")
+        raise
+    return conn
+
+
+# Full-jitter exponential backoff for databases failing with operational errors.
+# Consecutive failures per database; each entry is only touched by that database's writer thread.
+RETRY_BACKOFF_BASE_SECONDS = 1
+RETRY_BACKOFF_CAP_SECONDS = 30
+FAILED_ATTEMPTS = defaultdict(int)
+
+
+def retry_backoff_delay(attempt):
+    """Returns a random delay in [0, min(cap, base * 2**attempt)] seconds."""
+    return random.uniform(0, min(RETRY_BACKOFF_CAP_SECONDS, RETRY_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
 
+# Per-database buffer of timestamps not yet written. Bounded so an unreachable database
+# cannot grow memory without limit; the oldest rows are dropped first.
+PENDING = {cfg.name: deque(maxlen=1000) for cfg in DB_CONFIGS}
+LAST_FLUSH = defaultdict(float)
 
-def write_timestamp_to_db(db_config):
+
+# Successful flushes are logged only every LOG_EVERY_N_WRITES-th time; the counters carry the rest
+LOG_EVERY_N_WRITES = 30
+_write_counter = itertools.count()
+
+
+# (epoch second, formatted "YYYY-MM-DDTHH:MM:SS." prefix) of the last timestamp formatted.
+# Replaced as a whole tuple, so writer threads sharing it never see a torn pair.
+_iso_prefix = (None, '')
+
+
+def _fast_iso(ns):
+    """
+    Formats epoch nanoseconds as a local ISO-8601 timestamp that always has six fractional
+    digits (datetime.isoformat() omits them when the microsecond is 0). The date/time prefix
+    only changes once a second, so it is cached and only the microseconds are formatted per call.
+    """
+    global _iso_prefix
+    secs, rem = divmod(ns, 1_000_000_000)
+    cached_secs, prefix = _iso_prefix
+    if secs != cached_secs:
+        prefix = time.strftime('%Y-%m-%dT%H:%M:%S.', time.localtime(secs))
+        _iso_prefix = (secs, prefix)
+    return '%s%06d' % (prefix, rem // 1000)
+
+
+def insert_timestamps(cursor, rows):
     """
-    Writes the current timestamp to the specified database and records Prometheus metrics.
+    Inserts the buffered timestamps using the cheapest path for the batch size:
+    COPY for full batches, execute_values for smaller ones, the prepared INSERT for a single row.
+    """
+    if len(rows) >= DB_WRITE_BATCH_SIZE:
+        cursor.copy_from(io.StringIO("\n".join(rows) + "\n"), 'timestamps', columns=('timestamp',))
+    elif len(rows) > 1:
+        execute_values(cursor, "INSERT INTO timestamps (timestamp) VALUES %s", [(row,) for row in rows], page_size=100)
+    else:
+        cursor.execute("EXECUTE insert_ts (%s)", (rows[0],))
+
+
+def write_timestamp_to_db(db_config, conn):
+    """
+    Buffers the current timestamp for the specified database and, when a flush is due,
+    writes all pending timestamps in one transaction and records Prometheus metrics.
+    Opens the writer connection if there is none. Returns the connection to keep using,
+    or None if it was dropped after an error.
     Includes simulated timeout and general failure scenarios.
     """
-    database_name_label = db_config['name']
+    database_name_label = db_config.name
+    pending = PENDING[database_name_label]
+    pending.append(_fast_iso(time.time_ns()))
+    if len(pending) < DB_WRITE_BATCH_SIZE and \
+       time.monotonic() - LAST_FLUSH[database_name_label] < DB_FLUSH_INTERVAL_SECONDS:
+        return conn
 
     with DB_WRITE_LATENCY.labels(database_name=database_name_label).time():
         try:
             # Simulate a timeout or failure occasionally for demonstration.
             # Only simulate for a database named 'db1' for consistent testing.
-            if os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true':
-            #if os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true' and \
+            if SIMULATE_FAILURE:
+            #if SIMULATE_FAILURE and \
                #datetime.now().second % 10 == 0 and database_name_label == "db1":
                 raise Psycopg2OperationalError(f"Simulated database connection error or timeout for {database_name_label}")
 
-            conn = get_db_connection(db_config)
+            if conn is None:
+                conn = open_writer_connection(db_config)
+            rows = list(pending)
             cursor = conn.cursor()
-            current_time = datetime.now().isoformat()
-            cursor.execute("INSERT INTO timestamps (timestamp) VALUES (%s)", (current_time,))
+            insert_timestamps(cursor, rows)
             conn.commit()
-            conn.close()
+            # Only drop rows once they are committed; failed flushes are retried on the next one
+            for _ in rows:
+                pending.popleft()
+            LAST_FLUSH[database_name_label] = time.monotonic()
+            FAILED_ATTEMPTS.pop(database_name_label, None)
             DB_WRITE_SUCCESS_TOTAL.labels(database_name=database_name_label).inc()
-            app.logger.info(f"Timestamp '{current_time}' written successfully to '{db_config['dbname']}' (Logical Name: {database_name_label}).")
+            if next(_write_counter) % LOG_EVERY_N_WRITES == 0:
+                app.logger.info("%d timestamp(s) up to '%s' written successfully to '%s' (Logical Name: %s).", len(rows), rows[-1], db_config.dbname, database_name_label)
+            return conn
 
         except Psycopg2OperationalError as e:
+            FAILED_ATTEMPTS[database_name_label] += 1
             DB_WRITE_TIMEOUT_TOTAL.labels(database_name=database_name_label).inc()
             DB_WRITE_FAILURE_TOTAL.labels(database_name=database_name_label).inc()
             app.logger.error(f"PostgreSQL write failed for '{database_name_label}' (operational error/timeout): {e}")
         except Exception as e:
             DB_WRITE_FAILURE_TOTAL.labels(database_name=database_name_label).inc()
             app.logger.error(f"Database write failed for '{database_name_label}' (general error): {e}")
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
+
+    # Drop the connection after any failure; the writer thread reopens it on the next flush
+    if conn is not None:
+        conn.close()
+    return None
 
 
 # --- Periodic Background Task ---
-def periodic_db_writer():
+def db_writer_loop(db_config):
     """
-    Background thread function to periodically write timestamps to all configured databases.
+    Background thread function that owns one database's connection and periodically
+    writes timestamps to it. Each configured database gets its own thread, so a slow
+    or unreachable database only delays itself.
     """
+    conn = None
     while True:
-        for db_config in DB_CONFIGS:
-            try:
-                write_timestamp_to_db(db_config)
-            except Exception as e:
-                app.logger.error(f"Periodic DB writer encountered an error for '{db_config['name']}': {e}. Retrying after interval.")
-        time.sleep(DB_WRITE_INTERVAL_SECONDS)
+        try:
+            conn = write_timestamp_to_db(db_config, conn)
+        except Exception as e:
+            app.logger.error(f"Periodic DB writer encountered an error for '{db_config.name}': {e}. Retrying after interval.")
+
+        delay = DB_WRITE_INTERVAL_SECONDS
+        failed_attempts = FAILED_ATTEMPTS.get(db_config.name, 0)
+        if failed_attempts:
+            backoff = retry_backoff_delay(failed_attempts)
+            app.logger.info(f"Backing off writes to '{db_config.name}' for {backoff:.1f} extra seconds ({failed_attempts} consecutive failures).")
+            delay += backoff
+        time.sleep(delay)
 
 # --- Flask Routes ---
 
+# Rendered /metrics body, reused for _METRICS_CACHE_TTL seconds so back-to-back scrapes
+# do not each walk and format every series.
+_METRICS_CACHE = {"body": b"", "ts": float('-inf')}
+_METRICS_CACHE_TTL = 1.0
+_METRICS_CACHE_LOCK = threading.Lock()
+
 @app.route('/')
 def health_check():
     """Simple health check endpoint."""
@@ -216,23 +359,40 @@ def metrics():
     Returns the latest metrics in Prometheus exposition format.
     """
     app.logger.debug("Metrics endpoint accessed by Prometheus.")
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    with _METRICS_CACHE_LOCK:
+        now = time.monotonic()
+        if now - _METRICS_CACHE["ts"] > _METRICS_CACHE_TTL:
+            _METRICS_CACHE["body"] = generate_latest()
+            _METRICS_CACHE["ts"] = now
+        body = _METRICS_CACHE["body"]
+    return Response(body, mimetype=CONTENT_TYPE_LATEST)
 
 # --- Application Startup ---
-if __name__ == '__main__':
+# The app is served by gunicorn (see gunicorn.conf.py), which calls start_background_tasks()
+# once in its worker after the app is loaded.
+_BG_LOCK = threading.Lock()
+
+
+def start_background_tasks():
+    """
+    Starts one writer thread per configured database.
+    Safe to call more than once; only the first call does anything.
+    """
+    with _BG_LOCK:
+        if app.config.get('_BG_STARTED'):
+            return
+        app.config['_BG_STARTED'] = True
+
     app.logger.info("Starting Flask application...")
     for db_conf in DB_CONFIGS:
-        create_table(db_conf)
-
         # Initialize metrics for each database to ensure they are always exposed, even if 0
-        db_name_label = db_conf['name']
+        db_name_label = db_conf.name
         DB_WRITE_SUCCESS_TOTAL.labels(database_name=db_name_label).inc(0)
         DB_WRITE_FAILURE_TOTAL.labels(database_name=db_name_label).inc(0)
         DB_WRITE_TIMEOUT_TOTAL.labels(database_name=db_name_label).inc(0)
         # For Histogram, we don't need to explicitly touch it with 0, as it accumulates observations.
         # Its existence is determined by its first observation.
 
-    db_writer_thread = threading.Thread(target=periodic_db_writer, daemon=True)
-    db_writer_thread.start()
-
-    app.run(host='0.0.0.0', port=5000)
+        # The writer thread creates the table when it first connects
+        db_writer_thread = threading.Thread(target=db_writer_loop, args=(db_conf,), daemon=True, name=f"db-writer-{db_name_label}")
+        db_writer_thread.start()
@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+
+# Gunicorn settings for the multi-database writer.
+# Usage: gunicorn -c gunicorn.conf.py app:app
+
+bind = '0.0.0.0:5000'
+
+# A single worker process: the background writer and the Prometheus metrics live in
+# process memory, so more workers would duplicate writes and split the counters
+# between processes. Threads let /metrics and / be served while the writer is busy.
+workers = 1
+worker_class = 'gthread'
+threads = 8
+
+# Import the app once in the master so configuration errors fail fast at startup.
+preload_app = True
+
+# Directs access logs to stdout and error logs to stderr
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Starts the database writer threads inside the worker, after the fork."""
+    from app import start_background_tasks
+    start_background_tasks()
@@ -1,13 +1,19 @@
 # app.py
 
+import atexit
+import logging
+import logging.handlers
 import os
+import queue
+import sched
 import sqlite3
 import time
 import threading
-from datetime import datetime
+from collections import deque
+from contextlib import nullcontext
 
 from flask import Flask, Response
-from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Histogram, Counter, generate_latest, disable_created_metrics, CONTENT_TYPE_LATEST
 
 # --- OpenTelemetry Tracing Imports ---
 from opentelemetry import trace
@@ -17,10 +23,34 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
 from opentelemetry.trace import SpanKind
 from opentelemetry.semconv.trace import SpanAttributes
+from grpc import Compression
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# --- Configure Flask Logging ---
+# The writer logs through app.logger. Records are written directly until
+# start_log_listener() puts a queue in front of the stream.
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+app.logger.setLevel(logging.INFO)
+
+
+def start_log_listener():
+    """
+    Moves the root logger's handlers behind a queue drained by a listener thread, so logging
+    calls on the writer and request threads only enqueue. Called from start_background_tasks(),
+    i.e. in the gunicorn worker: a thread started at import would not survive the fork.
+    """
+    root = logging.getLogger()
+    stream_handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    for handler in stream_handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *stream_handlers)
+    listener.start()
+    atexit.register(listener.stop) # Flush queued records on shutdown
+
 # --- Database Configuration ---
 DB_NAME = os.getenv('DB_NAME', ':memory:')
 DB_USER = os.getenv('DB_USER')
@@ -34,7 +64,41 @@ except ValueError:
     print("Warning: DB_WRITE_INTERVAL_SECONDS environment variable is not an integer. Using default 5 seconds.")
     DB_WRITE_INTERVAL_SECONDS = 5
 
+# Read once at startup; the writer checks this on every tick.
+SIMULATE_FAILURE = os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true'
+
+# Set to "false" to stop the in-process scheduler from writing; timestamps are then only
+# written when POST /tick is called (e.g. by the CronJob in openshift/tick-cronjob.yaml).
+SCHEDULED_WRITES = os.getenv('DB_SCHEDULED_WRITES', 'true').lower() == 'true'
+
+# Timestamps are buffered and flushed in one transaction once DB_WRITE_BATCH_SIZE rows are
+# pending or DB_FLUSH_INTERVAL_SECONDS have passed since the last flush, whichever comes first.
+# The flush interval defaults to the write interval, i.e. one flush per tick.
+try:
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 1000))
+except ValueError:
+    print("Warning: DB_WRITE_BATCH_SIZE environment variable is not an integer. Using default 1000 rows.")
+    DB_WRITE_BATCH_SIZE = 1000
+
+try:
+    DB_FLUSH_INTERVAL_SECONDS = int(os.getenv('DB_FLUSH_INTERVAL_SECONDS', DB_WRITE_INTERVAL_SECONDS))
+except ValueError:
+    print(f"Warning: DB_FLUSH_INTERVAL_SECONDS environment variable is not an integer. Using the write interval ({DB_WRITE_INTERVAL_SECONDS} seconds).")
+    DB_FLUSH_INTERVAL_SECONDS = DB_WRITE_INTERVAL_SECONDS
+
+# Attributes of the db_write span. They never change for this process, so build them once.
+DB_SPAN_ATTRS = {
+    SpanAttributes.DB_SYSTEM: "sqlite" if DB_NAME == ':memory:' or DB_NAME.endswith('.db') else "sql",
+    SpanAttributes.DB_NAME: DB_NAME,
+    SpanAttributes.DB_OPERATION: "INSERT",
+    SpanAttributes.DB_STATEMENT: "INSERT INTO timestamps (ts_ns) VALUES (?)",
+    # Add more attributes as needed, e.g., db.user, network.peer.address
+}
+
 # --- Prometheus Metrics Initialization ---
+# Skip the *_created series: no dashboard reads them, and each metric would add one to every scrape.
+disable_created_metrics()
+
 DB_WRITE_LATENCY = Histogram(
     'db_write_latency_seconds',
     'Latency of database write operations to the timestamps table.',
@@ -55,7 +119,14 @@ DB_WRITE_TIMEOUT_TOTAL = Counter(
 
 # --- OpenTelemetry Tracing Configuration ---
 def init_tracer():
-    """Initializes the OpenTelemetry tracer and OTLP exporter."""
+    """
+    Initializes the OpenTelemetry tracer and OTLP exporter.
+    Returns None when tracing is turned off with OTEL_SDK_DISABLED=true.
+    """
+    if os.getenv('OTEL_SDK_DISABLED', 'false').lower() == 'true':
+        print("OpenTelemetry tracing disabled via OTEL_SDK_DISABLED.")
+        return None
+
     # Define resource attributes for your service
     resource = Resource.create({
         SpanAttributes.SERVICE_NAME: "flask-db-writer",
@@ -72,10 +143,18 @@ def init_tracer():
     # The URL can be set via OTEL_EXPORTER_OTLP_ENDPOINT environment variable.
     # For Tempo, the default OTLP gRPC port is 4317.
     # Example: OTEL_EXPORTER_OTLP_ENDPOINT="http://tempo-distributor.tempo.svc.cluster.local:4317"
-    otlp_exporter = OTLPSpanExporter()
+    # Gzip shrinks the export payload on the wire.
+    otlp_exporter = OTLPSpanExporter(compression=Compression.Gzip)
 
     # Add the exporter to the TracerProvider
-    span_processor = BatchSpanProcessor(otlp_exporter)
+    # With one span per write interval, a longer schedule delay and larger batches let
+    # several spans share one export RPC instead of paying for one each.
+    span_processor = BatchSpanProcessor(
+        otlp_exporter,
+        max_queue_size=4096,
+        schedule_delay_millis=10000,
+        max_export_batch_size=256
+    )
     provider.add_span_processor(span_processor)
 
     # Set the global tracer provider
@@ -89,12 +168,21 @@ tracer = init_tracer()
 
 # --- Database Functions ---
 
-def get_db_connection():
-    """Establishes and returns a database connection."""
+def open_db_connection():
+    """Establishes and returns a new database connection."""
     if DB_NAME == ':memory:' or not DB_NAME.endswith('.db'):
         print(f"Connecting to SQLite database: {DB_NAME}")
-        conn = sqlite3.connect(DB_NAME)
+        # Autocommit mode; shared between Flask and the writer thread under DB_LOCK
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False, isolation_level=None)
         conn.row_factory = sqlite3.Row
+        if DB_NAME != ':memory:':
+            # WAL with synchronous=NORMAL avoids an fsync on every commit
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # Keep temp tables in memory, use a 64 MiB page cache and read through a 256 MiB mmap
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-65536")
+            conn.execute("PRAGMA mmap_size=268435456")
         return conn
     else:
         # Example for an external database like PostgreSQL (requires 'psycopg2' library)
@@ -115,107 +203,241 @@ def get_db_connection():
         #     raise
         print("WARNING: External database connection not implemented in this example.")
         print("Please replace SQLite connection with your actual database driver and connection logic.")
-        conn = sqlite3.connect(':memory:')
+        conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
         conn.row_factory = sqlite3.Row
         return conn
 
 
+# A single connection is opened at startup and kept for the life of the process.
+# Reopening per write is slow, and for ':memory:' it would also drop the table.
+DB_CONN = open_db_connection()
+DB_LOCK = threading.Lock()
+
+
+def get_db_connection():
+    """Returns the process-wide database connection. Hold DB_LOCK while using it."""
+    return DB_CONN
+
+
+def retire_legacy_table(cursor):
+    """
+    Renames an existing timestamps table aside if it predates the ts_ns schema (the old
+    id / timestamp TEXT layout), so the current table can be created in its place.
+    The old rows are kept in the renamed table, not migrated. Hold DB_LOCK while calling this.
+    """
+    columns = [row['name'] for row in cursor.execute("PRAGMA table_info(timestamps)")]
+    if not columns or 'ts_ns' in columns:
+        return
+    legacy_name = time.strftime('timestamps_legacy_%Y%m%d%H%M%S', time.gmtime())
+    cursor.execute(f"ALTER TABLE timestamps RENAME TO {legacy_name}")
+    print(f"WARNING: Table 'timestamps' has no ts_ns column (pre-epoch-nanoseconds schema). "
+          f"Renamed it to '{legacy_name}' and creating a new 'timestamps' table; its rows were not migrated.")
+
+
 def create_table():
     """Creates the timestamps table if it doesn't exist."""
     try:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS timestamps (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL
-            )
-        ''')
-        conn.commit()
-        conn.close()
+        with DB_LOCK:
+            cursor = conn.cursor()
+            # The view is recreated below; drop it first so it does not follow a renamed legacy table.
+            cursor.execute("DROP VIEW IF EXISTS timestamps_iso")
+            retire_legacy_table(cursor)
+            # Timestamps are stored as integer nanoseconds since the epoch.
+            # No id column: the implicit rowid keeps insertion order without AUTOINCREMENT's
+            # extra sqlite_sequence update on every insert.
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS timestamps (
+                    ts_ns INTEGER NOT NULL
+                )
+            ''')
+            # Human-readable view of the same rows. Dropped above and recreated so an older view
+            # that still exposes id is replaced rather than kept.
+            cursor.execute('''
+                CREATE VIEW timestamps_iso AS
+                SELECT strftime('%Y-%m-%dT%H:%M:%f', ts_ns / 1e9, 'unixepoch') AS timestamp
+                FROM timestamps
+            ''')
+            conn.commit()
         print(f"Database table 'timestamps' ensured to exist in '{DB_NAME}'.")
     except Exception as e:
         print(f"Error creating database table: {e}")
 
-def write_timestamp_to_db():
+def insert_timestamps(cursor, rows):
     """
-    Writes the current timestamp to the database, records Prometheus metrics,
-    and creates an OpenTelemetry span for tracing.
+    Inserts the buffered timestamps in one explicit transaction; the connection is in
+    autocommit mode, so without BEGIN each row would be committed on its own.
+    Rolls back and re-raises if any row fails. Hold DB_LOCK while calling this.
     """
+    cursor.execute("BEGIN")
+    try:
+        cursor.executemany("INSERT INTO timestamps (ts_ns) VALUES (?)", [(row,) for row in rows])
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+
+
+# Timestamps not yet written. Bounded so a failing database cannot grow memory without limit;
+# the oldest rows are dropped first.
+_pending = deque(maxlen=10 * DB_WRITE_BATCH_SIZE)
+_last_flush = float('-inf')
+# Serializes the scheduler job and POST /tick, which share the pending buffer.
+WRITE_LOCK = threading.Lock()
+
+
+def write_timestamp_to_db(force=False, now=None):
+    """
+    Buffers the current timestamp and, when a flush is due (or force is set), writes all pending
+    timestamps in one transaction, records Prometheus metrics, and creates an OpenTelemetry span
+    for tracing. Returns False if the flush failed, True otherwise.
+    now is the monotonic time of this tick; the scheduler passes its deadline so that ticks one
+    flush interval apart always flush. Defaults to the current time.
+    """
+    global _last_flush
+    _pending.append(time.time_ns())
+    if now is None:
+        now = time.monotonic()
+    # Compared as deadline + interval, the same sum the scheduler uses for its next deadline,
+    # so the next tick is never a rounding error short of being due
+    if not force and len(_pending) < DB_WRITE_BATCH_SIZE and \
+       now < _last_flush + DB_FLUSH_INTERVAL_SECONDS:
+        return True
+
     # Create a new OpenTelemetry span for this database write operation
     # SpanKind.CLIENT indicates an outgoing request (e.g., to a database)
-    with tracer.start_as_current_span(
-        "db_write",
-        kind=SpanKind.CLIENT,
-        attributes={
-            SpanAttributes.DB_SYSTEM: "sqlite" if DB_NAME == ':memory:' or DB_NAME.endswith('.db') else "sql",
-            SpanAttributes.DB_NAME: DB_NAME,
-            SpanAttributes.DB_OPERATION: "INSERT",
-            SpanAttributes.DB_STATEMENT: "INSERT INTO timestamps (timestamp) VALUES (?)",
-            # Add more attributes as needed, e.g., db.user, network.peer.address
-        }
-    ) as span:
+    # With tracing disabled, a no-op span keeps the calls below free.
+    if tracer:
+        span_context = tracer.start_as_current_span("db_write", kind=SpanKind.CLIENT, attributes=DB_SPAN_ATTRS)
+    else:
+        span_context = nullcontext(trace.INVALID_SPAN)
+    failed = False
+    with span_context as span:
         with DB_WRITE_LATENCY.time():
             try:
-                if os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true' and \
-                   datetime.now().second % 10 == 0:
+                if SIMULATE_FAILURE and time.time() % 10 < 1:
                     span.set_status(trace.Status(trace.StatusCode.ERROR, "Simulated database connection error or timeout"))
                     span.record_exception(sqlite3.OperationalError("Simulated database connection error or timeout"))
                     raise sqlite3.OperationalError("Simulated database connection error or timeout")
 
+                rows = list(_pending)
                 conn = get_db_connection()
-                cursor = conn.cursor()
-                current_time = datetime.now().isoformat()
-                cursor.execute("INSERT INTO timestamps (timestamp) VALUES (?)", (current_time,))
-                conn.commit()
-                conn.close()
+                with DB_LOCK:
+                    insert_timestamps(conn.cursor(), rows)
+                # Only drop rows once they are committed; failed flushes are retried on the next one
+                for _ in rows:
+                    _pending.popleft()
+                # The tick time, not the commit time: stamping it after the write would leave
+                # the next tick a write-duration short of the flush interval
+                _last_flush = now
                 DB_WRITE_SUCCESS_TOTAL.inc()
-                print(f"Timestamp '{current_time}' written successfully to '{DB_NAME}'.")
+                span.set_attribute("db.batch_size", len(rows))
+                # Per-write success is debug-only; DB_WRITE_SUCCESS_TOTAL tracks it
+                app.logger.debug("%d timestamp(s) up to ts_ns=%d written successfully to '%s'.", len(rows), rows[-1], DB_NAME)
                 span.set_status(trace.Status(trace.StatusCode.OK)) # Mark span as success
 
-            except (sqlite3.OperationalError, Exception) as e:
+            except sqlite3.OperationalError as e:
+                failed = True
+                # Operational errors (locked database, I/O errors, the simulated failure) count as timeouts
+                DB_WRITE_TIMEOUT_TOTAL.inc()
                 DB_WRITE_FAILURE_TOTAL.inc()
                 # Set span status to ERROR and record the exception
                 span.set_status(trace.Status(trace.StatusCode.ERROR, f"Database write failed: {e}"))
                 span.record_exception(e)
-                if "timeout" in str(e).lower() or "operationalerror" in str(e).lower():
-                    DB_WRITE_TIMEOUT_TOTAL.inc()
-                    span.set_attribute("db.timeout", True) # Custom attribute for timeout
-                    print(f"Database write failed (simulated timeout/operational error): {e}")
-                else:
-                    print(f"Database write failed (general error): {e}")
+                span.set_attribute("db.timeout", True) # Custom attribute for timeout
+                app.logger.error(f"Database write failed (simulated timeout/operational error): {e}")
+            except Exception as e:
+                failed = True
+                DB_WRITE_FAILURE_TOTAL.inc()
+                span.set_status(trace.Status(trace.StatusCode.ERROR, f"Database write failed: {e}"))
+                span.record_exception(e)
+                app.logger.error(f"Database write failed (general error): {e}")
+    return not failed
 
 
 # --- Periodic Background Task ---
-def periodic_db_writer():
+# One scheduler thread runs all periodic work. Jobs re-arm themselves at fixed deadlines,
+# so time spent writing (or waiting on other threads) does not push later runs back.
+SCHEDULER = sched.scheduler(time.monotonic, time.sleep)
+
+
+def periodic_db_writer(deadline):
     """
-    Background thread function to periodically write timestamps to the database.
+    Scheduler job that writes a timestamp to the database, then re-arms itself
+    DB_WRITE_INTERVAL_SECONDS after its deadline.
     Each write will now also generate an OpenTelemetry trace.
     """
-    while True:
-        write_timestamp_to_db()
-        time.sleep(DB_WRITE_INTERVAL_SECONDS)
+    with WRITE_LOCK:
+        write_timestamp_to_db(now=deadline)
+    next_run = deadline + DB_WRITE_INTERVAL_SECONDS
+    now = time.monotonic()
+    if next_run < now:
+        # Fell behind by more than an interval; skip the missed ticks instead of bursting
+        next_run = now
+    SCHEDULER.enterabs(next_run, 1, periodic_db_writer, (next_run,))
 
 # --- Flask Routes ---
 
+# Rendered /metrics body, reused for _METRICS_CACHE_TTL seconds so back-to-back scrapes
+# do not each walk and format every series.
+_METRICS_CACHE = {"body": b"", "ts": float('-inf')}
+_METRICS_CACHE_TTL = 1.0
+_METRICS_CACHE_LOCK = threading.Lock()
+
 @app.route('/')
 def health_check():
     """Simple health check endpoint."""
     return "Flask app is running and writing timestamps!", 200
 
+@app.route('/tick', methods=['POST'])
+def tick():
+    """
+    Writes a timestamp on demand, e.g. from a Kubernetes CronJob, flushing everything pending.
+    With DB_SCHEDULED_WRITES=false this is the only way timestamps are written.
+    Returns 204 once the rows are committed, 503 if the write failed.
+    """
+    with WRITE_LOCK:
+        written = write_timestamp_to_db(force=True)
+    # A failed write surfaces as a failed request, so the CronJob's curl -f fails too
+    if not written:
+        return "Database write failed", 503
+    return '', 204
+
 @app.route('/metrics')
 def metrics():
     """
     Endpoint for Prometheus to scrape metrics.
     Returns the latest metrics in Prometheus exposition format.
     """
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    with _METRICS_CACHE_LOCK:
+        now = time.monotonic()
+        if now - _METRICS_CACHE["ts"] > _METRICS_CACHE_TTL:
+            _METRICS_CACHE["body"] = generate_latest()
+            _METRICS_CACHE["ts"] = now
+        body = _METRICS_CACHE["body"]
+    return Response(body, mimetype=CONTENT_TYPE_LATEST)
 
 # --- Application Startup ---
-if __name__ == '__main__':
-    create_table()
+# The app is served by gunicorn (see gunicorn.conf.py), which calls start_background_tasks()
+# once in its worker after the app is loaded.
+_BG_LOCK = threading.Lock()
+
+
+def start_background_tasks():
+    """
+    Creates the table, schedules the periodic writer (unless DB_SCHEDULED_WRITES=false) and
+    starts the scheduler thread.
+    Safe to call more than once; only the first call does anything.
+    """
+    with _BG_LOCK:
+        if app.config.get('_BG_STARTED'):
+            return
+        app.config['_BG_STARTED'] = True
 
-    db_writer_thread = threading.Thread(target=periodic_db_writer, daemon=True)
-    db_writer_thread.start()
+    start_log_listener()
+    create_table()
 
-    app.run(host='0.0.0.0', port=5000)
+    if SCHEDULED_WRITES:
+        SCHEDULER.enter(0, 1, periodic_db_writer, (time.monotonic(),))
+    scheduler_thread = threading.Thread(target=SCHEDULER.run, daemon=True, name="scheduler")
+    scheduler_thread.start()
@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+
+# Gunicorn settings for the traced SQLite timestamp writer.
+# Usage: gunicorn -c gunicorn.conf.py app:app
+
+bind = '0.0.0.0:5000'
+
+# A single worker process: the background writer, the SQLite connection and the Prometheus
+# metrics live in process memory, so more workers would duplicate writes and split the
+# counters between processes. Threads let /metrics and / be served while the writer is busy.
+workers = 1
+worker_class = 'gthread'
+threads = 8
+
+# Not preloaded: importing the app opens the OTLP gRPC channel and the span exporter thread,
+# which must be created in the worker rather than inherited across the fork.
+preload_app = False
+
+# Directs access logs to stdout and error logs to stderr
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Starts the scheduler thread that runs the database writes inside the worker, after the fork."""
+    from app import start_background_tasks
+    start_background_tasks()
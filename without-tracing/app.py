@@ -1,17 +1,27 @@
 # app.py
 
+import atexit
+import io
 import os
+import queue
+import sched
+import struct
 import time
 import threading
-from datetime import datetime
+import weakref
+from collections import deque
 import logging # Import the logging module
+import logging.handlers
 
 from flask import Flask, Response
-from prometheus_client import Histogram, Counter, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Histogram, Counter, generate_latest, disable_created_metrics, CONTENT_TYPE_LATEST
 
 # --- PostgreSQL Import ---
 import psycopg2
+import psycopg2.pool
+from psycopg2.extensions import make_dsn
 from psycopg2 import OperationalError as Psycopg2OperationalError # Alias to avoid conflict with sqlite3.OperationalError
+from psycopg2.extras import execute_values
 
 
 # Initialize Flask app
@@ -21,9 +31,27 @@ app = Flask(__name__)
 # Set up a basic logging configuration for the Flask app.
 # This ensures application messages are properly emitted.
 # Logs will go to stdout, which Kubernetes/OpenShift captures.
+# Records are written directly until start_log_listener() puts a queue in front of the stream.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 app.logger.setLevel(logging.INFO) # Set default level for app.logger
 
+
+def start_log_listener():
+    """
+    Moves the root logger's handlers behind a queue drained by a listener thread, so logging
+    calls on the writer and request threads only enqueue. Called from start_background_tasks(),
+    i.e. in the gunicorn worker: a thread started at import would not survive the fork.
+    """
+    root = logging.getLogger()
+    stream_handlers = root.handlers[:]
+    log_queue = queue.SimpleQueue()
+    for handler in stream_handlers:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *stream_handlers)
+    listener.start()
+    atexit.register(listener.stop) # Flush queued records on shutdown
+
 # --- Database Configuration ---
 # Read DB_NAME from environment variable. For PostgreSQL, this is the database name.
 DB_NAME = os.getenv('DB_NAME') # This should now be mandatory for an external DB
@@ -41,6 +69,16 @@ if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT]):
     # In a real app, you might want to raise an exception or exit more gracefully.
     exit(1)
 
+# libpq connection string, built once; make_dsn quotes values such as passwords with spaces.
+_DSN = make_dsn(
+    host=DB_HOST,
+    port=DB_PORT,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    dbname=DB_NAME,
+    application_name='flask-timestamp-writer', # Identifies these sessions in pg_stat_activity
+    connect_timeout=5 # Set a connection timeout (e.g., 5 seconds)
+)
 
 # Read write interval from environment variable, default to 5 seconds.
 try:
@@ -49,7 +87,40 @@ except ValueError:
     app.logger.warning("DB_WRITE_INTERVAL_SECONDS environment variable is not an integer. Using default 5 seconds.")
     DB_WRITE_INTERVAL_SECONDS = 5
 
+# Read once at startup; the writer checks this on every tick.
+SIMULATE_FAILURE = os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true'
+
+# Set to "false" to stop the in-process scheduler from writing; timestamps are then only
+# written when POST /tick is called (e.g. by the CronJob in openshift/tick-cronjob.yaml).
+SCHEDULED_WRITES = os.getenv('DB_SCHEDULED_WRITES', 'true').lower() == 'true'
+
+# Timestamps are buffered and flushed in one transaction once DB_WRITE_BATCH_SIZE rows are
+# pending or DB_FLUSH_INTERVAL_SECONDS have passed since the last flush, whichever comes first.
+# The flush interval defaults to the write interval, i.e. one flush per tick.
+try:
+    DB_WRITE_BATCH_SIZE = int(os.getenv('DB_WRITE_BATCH_SIZE', 1000))
+except ValueError:
+    app.logger.warning("DB_WRITE_BATCH_SIZE environment variable is not an integer. Using default 1000 rows.")
+    DB_WRITE_BATCH_SIZE = 1000
+
+try:
+    DB_FLUSH_INTERVAL_SECONDS = int(os.getenv('DB_FLUSH_INTERVAL_SECONDS', DB_WRITE_INTERVAL_SECONDS))
+except ValueError:
+    app.logger.warning(f"DB_FLUSH_INTERVAL_SECONDS environment variable is not an integer. Using the write interval ({DB_WRITE_INTERVAL_SECONDS} seconds).")
+    DB_FLUSH_INTERVAL_SECONDS = DB_WRITE_INTERVAL_SECONDS
+
+# Daily partitions older than DB_RETENTION_DAYS are dropped by the partition maintenance job.
+# 0 (the default) keeps everything.
+try:
+    DB_RETENTION_DAYS = int(os.getenv('DB_RETENTION_DAYS', 0))
+except ValueError:
+    app.logger.warning("DB_RETENTION_DAYS environment variable is not an integer. Keeping all partitions.")
+    DB_RETENTION_DAYS = 0
+
 # --- Prometheus Metrics Initialization ---
+# Skip the *_created series: no dashboard reads them, and each metric would add one to every scrape.
+disable_created_metrics()
+
 # Histogram metric for database write latency (seconds)
 # Define custom buckets for more granular latency distribution analysis.
 # For example, you might want finer buckets for low latencies.
@@ -79,22 +150,33 @@ DB_WRITE_TIMEOUT_TOTAL = Counter(
 
 # --- Database Functions ---
 
+# Connection pool shared by create_table() and the writer thread, so writes reuse an
+# open connection instead of paying for a TCP handshake and authentication every time.
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_db_pool():
+    """
+    Creates the connection pool if it doesn't exist yet.
+    Called at startup, and again on demand if the database was unreachable then.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            app.logger.info(f"Creating connection pool for PostgreSQL database: {DB_USER}@tcp({DB_HOST}:{DB_PORT})/{DB_NAME}")
+            _pool = psycopg2.pool.ThreadedConnectionPool(minconn=1, maxconn=4, dsn=_DSN)
+    return _pool
+
+
 def get_db_connection():
     """
-    Establishes and returns a PostgreSQL database connection.
-    Uses environment variables for connection parameters.
+    Returns a pooled PostgreSQL database connection.
+    Must be handed back with release_db_connection().
     """
     try:
-        app.logger.info(f"Connecting to PostgreSQL database: {DB_USER}@tcp({DB_HOST}:{DB_PORT})/{DB_NAME}")
-        conn = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            connect_timeout=5 # Set a connection timeout (e.g., 5 seconds)
-        )
-        return conn
+        pool = _pool if _pool is not None else init_db_pool()
+        return pool.getconn()
     except Psycopg2OperationalError as e:
         app.logger.error(f"PostgreSQL connection failed (OperationalError): {e}")
         raise # Re-raise to ensure the error is handled upstream
@@ -103,85 +185,314 @@ def get_db_connection():
         raise # Re-raise to ensure the error is handled upstream
 
 
+# Pooled connections that already hold the ins_ts prepared statement.
+# psycopg2 connections have no attribute dict, so track them here; closed connections drop out.
+_prepared_conns = weakref.WeakSet()
+
+
+def prepare_connection(conn):
+    """
+    Prepares the timestamp INSERT once per pooled connection, so the server parses and plans it
+    only once per session instead of on every write.
+    """
+    if conn in _prepared_conns:
+        return
+    cursor = conn.cursor()
+    cursor.execute("PREPARE ins_ts (bigint) AS INSERT INTO timestamps (ts_ns) VALUES ($1)")
+    conn.commit()
+    _prepared_conns.add(conn)
+
+
+def release_db_connection(conn, close=False):
+    """Returns a connection to the pool. Pass close=True to discard a broken connection."""
+    _pool.putconn(conn, close=close)
+
+
+# Set once create_table() has succeeded; until then the partition maintenance job retries it.
+_table_created = False
+
+
+def retire_legacy_table(cursor):
+    """
+    Renames an existing timestamps table aside if it predates the current schema, so the
+    current table can be created in its place: either the old id SERIAL / timestamp TEXT layout,
+    or a ts_ns table that is not partitioned. CREATE TABLE IF NOT EXISTS would otherwise keep
+    the old table, and every insert or partition creation would fail.
+    The old rows are kept in the renamed table, not migrated. Call inside create_table()'s transaction.
+    """
+    cursor.execute('''
+        SELECT to_regclass('timestamps') IS NOT NULL,
+               EXISTS (SELECT 1 FROM pg_attribute
+                       WHERE attrelid = to_regclass('timestamps') AND attname = 'ts_ns' AND NOT attisdropped),
+               EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('timestamps'))
+    ''')
+    exists, has_ts_ns, partitioned = cursor.fetchone()
+    if not exists or (has_ts_ns and partitioned):
+        return
+    legacy_name = time.strftime('timestamps_legacy_%Y%m%d%H%M%S', time.gmtime())
+    cursor.execute(f"ALTER TABLE timestamps RENAME TO {legacy_name}")
+    # Index names are not changed by the rename; free the BRIN index name for the new table.
+    cursor.execute(f"ALTER INDEX IF EXISTS timestamps_ts_ns_brin RENAME TO {legacy_name}_ts_ns_brin")
+    reason = "is not partitioned" if has_ts_ns else "has no ts_ns column (pre-epoch-nanoseconds schema)"
+    app.logger.warning(f"Table 'timestamps' {reason}. Renamed it to '{legacy_name}' and creating "
+                       f"a new partitioned 'timestamps' table; its rows were not migrated.")
+
+
 def create_table():
-    """Creates the timestamps table if it doesn't exist in PostgreSQL."""
+    """
+    Creates the timestamps table if it doesn't exist in PostgreSQL.
+    Returns True on success, False if the DDL failed.
+    """
+    global _table_created
+    conn = None
+    failed = False
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        # PostgreSQL specific SQL for auto-incrementing ID
+        # The view is recreated below; drop it first so it does not follow a renamed legacy table.
+        cursor.execute("DROP VIEW IF EXISTS timestamps_iso")
+        retire_legacy_table(cursor)
+        # Timestamps are stored as BIGINT nanoseconds since the epoch.
+        # No id column, so inserts don't draw from a sequence; the append-only, monotonic ts_ns
+        # gets a BRIN index instead, which is tiny and cheap to maintain.
+        # The table is range-partitioned by day (see maintain_partitions()), so inserts always land
+        # in a small, recent partition and old data is removed by dropping whole partitions.
+        # There is no DEFAULT partition: rows parked there would block creating the partition
+        # for their day. Partitions are created days ahead instead, and a write for a day
+        # without one fails and stays buffered until maintenance has created it.
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS timestamps (
-                id SERIAL PRIMARY KEY,
-                timestamp TEXT NOT NULL
-            )
+                ts_ns BIGINT NOT NULL
+            ) PARTITION BY RANGE (ts_ns)
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS timestamps_ts_ns_brin ON timestamps USING brin (ts_ns)")
+        # Human-readable view of the same rows. Dropped above and recreated rather than replaced:
+        # CREATE OR REPLACE VIEW cannot drop columns, and an older view still exposes id.
+        cursor.execute('''
+            CREATE VIEW timestamps_iso AS
+            SELECT to_timestamp(ts_ns / 1e9) AS timestamp
+            FROM timestamps
         ''')
         conn.commit()
-        conn.close()
+        _table_created = True
         app.logger.info(f"Database table 'timestamps' ensured to exist in PostgreSQL database '{DB_NAME}'.")
     except Exception as e:
+        failed = True
         app.logger.error(f"Error creating database table in PostgreSQL: {e}")
         # Depending on the error, you might want to exit if table creation is critical.
         # For now, we'll let the app continue if it's a transient error.
+    finally:
+        # Hand the connection back to the pool; discard it if the DDL failed
+        if conn is not None:
+            release_db_connection(conn, close=failed)
+    return not failed
+
+NS_PER_DAY = 86_400 * 1_000_000_000
+PARTITION_DAYS_AHEAD = 7
+PARTITION_MAINTENANCE_INTERVAL_SECONDS = 3600
+PARTITION_MAINTENANCE_RETRY_SECONDS = 60
 
-def write_timestamp_to_db():
+
+def partition_name(day):
+    """Returns the name of the partition holding the given UTC day (days since the epoch)."""
+    return time.strftime('timestamps_%Y%m%d', time.gmtime(day * 86_400))
+
+
+def maintain_partitions():
+    """
+    Scheduler job that creates the table if that has not succeeded yet, the daily partitions
+    for today and the next PARTITION_DAYS_AHEAD days and, when DB_RETENTION_DAYS is set, drops
+    partitions older than that. Re-arms itself every hour, or sooner if anything failed.
+    """
+    if not (_table_created or create_table()):
+        SCHEDULER.enter(PARTITION_MAINTENANCE_RETRY_SECONDS, 2, maintain_partitions)
+        return
+
+    conn = None
+    failed = False
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        today = time.time_ns() // NS_PER_DAY
+        for day in range(today, today + PARTITION_DAYS_AHEAD + 1):
+            # One transaction per partition, so one that cannot be created does not block the rest
+            try:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF timestamps "
+                               f"FOR VALUES FROM ({day * NS_PER_DAY}) TO ({(day + 1) * NS_PER_DAY})")
+                conn.commit()
+            except psycopg2.DatabaseError as e:
+                conn.rollback()
+                failed = True
+                app.logger.error(f"Could not create partition '{partition_name(day)}': {e}")
+        if DB_RETENTION_DAYS > 0:
+            # Partition names sort by date, so older partitions compare lower
+            oldest_kept = partition_name(today - DB_RETENTION_DAYS)
+            cursor.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                           "WHERE i.inhparent = 'timestamps'::regclass")
+            for (name,) in cursor.fetchall():
+                if name < oldest_kept:
+                    cursor.execute(f"DROP TABLE {name}")
+                    app.logger.info(f"Dropped partition '{name}' (older than {DB_RETENTION_DAYS} days).")
+        conn.commit()
+    except Exception as e:
+        failed = True
+        app.logger.error(f"Partition maintenance failed: {e}")
+    finally:
+        # Hand the connection back to the pool; discard it if maintenance failed
+        if conn is not None:
+            release_db_connection(conn, close=failed)
+    delay = PARTITION_MAINTENANCE_RETRY_SECONDS if failed else PARTITION_MAINTENANCE_INTERVAL_SECONDS
+    SCHEDULER.enter(delay, 2, maintain_partitions)
+
+
+# PostgreSQL binary COPY framing: signature, flags and header-extension length, then per row a
+# field count, the field's byte length and the big-endian int8 value, then a -1 trailer.
+_COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_BINARY_ROW = struct.Struct('>hiq')
+_COPY_BINARY_TRAILER = struct.pack('>h', -1)
+
+
+def insert_timestamps(cursor, rows):
+    """
+    Streams the buffered timestamps into the table with binary COPY, which skips per-row SQL
+    parsing and the server-side text-to-bigint conversion.
+    Falls back to a multi-row INSERT if the server rejects COPY (e.g. missing privileges).
+    A single row goes through the prepared INSERT instead.
+    """
+    if len(rows) == 1:
+        cursor.execute("EXECUTE ins_ts (%s)", (rows[0],))
+        return
+    try:
+        payload = b''.join([_COPY_BINARY_HEADER, *(_COPY_BINARY_ROW.pack(1, 8, row) for row in rows), _COPY_BINARY_TRAILER])
+        cursor.copy_expert("COPY timestamps(ts_ns) FROM STDIN WITH (FORMAT binary)", io.BytesIO(payload))
+    except psycopg2.ProgrammingError as e:
+        app.logger.warning(f"COPY rejected, falling back to INSERT: {e}")
+        cursor.connection.rollback()
+        execute_values(cursor, "INSERT INTO timestamps (ts_ns) VALUES %s", [(row,) for row in rows], page_size=1000)
+
+
+# Timestamps not yet written. Bounded so an unreachable database cannot grow memory without
+# limit; the oldest rows are dropped first.
+_pending = deque(maxlen=10 * DB_WRITE_BATCH_SIZE)
+_last_flush = float('-inf')
+# Serializes the scheduler job and POST /tick, which share the pending buffer.
+WRITE_LOCK = threading.Lock()
+
+
+def write_timestamp_to_db(force=False, now=None):
     """
-    Writes the current timestamp to the database and records Prometheus metrics.
+    Buffers the current timestamp and, when a flush is due (or force is set), writes all pending
+    timestamps in one transaction and records Prometheus metrics.
+    Returns False if the flush failed, True otherwise.
+    now is the monotonic time of this tick; the scheduler passes its deadline so that ticks one
+    flush interval apart always flush. Defaults to the current time.
     Includes simulated timeout and general failure scenarios.
     """
+    global _last_flush
+    _pending.append(time.time_ns())
+    if now is None:
+        now = time.monotonic()
+    # Compared as deadline + interval, the same sum the scheduler uses for its next deadline,
+    # so the next tick is never a rounding error short of being due
+    if not force and len(_pending) < DB_WRITE_BATCH_SIZE and \
+       now < _last_flush + DB_FLUSH_INTERVAL_SECONDS:
+        return True
+
+    conn = None
+    failed = False
     with DB_WRITE_LATENCY.time(): # Measure the duration of this block
         try:
             # Simulate a timeout or failure occasionally for demonstration.
             # In a real scenario, network issues or DB server unresponsiveness
             # would lead to actual timeouts caught by your DB driver.
-            if os.getenv('SIMULATE_DB_FAILURE', 'false').lower() == 'true' and \
-               datetime.now().second % 10 == 0: # Simulate failure every 10 seconds
+            if SIMULATE_FAILURE and time.time() % 10 < 1: # Simulate failure every 10 seconds
                 raise Psycopg2OperationalError("Simulated database connection error or timeout")
 
+            rows = list(_pending)
             conn = get_db_connection()
+            prepare_connection(conn)
             cursor = conn.cursor()
-            current_time = datetime.now().isoformat()
-            cursor.execute("INSERT INTO timestamps (timestamp) VALUES (%s)", (current_time,)) # Use %s for psycopg2 placeholders
+            insert_timestamps(cursor, rows)
             conn.commit()
-            conn.close()
+            # Only drop rows once they are committed; failed flushes are retried on the next one
+            for _ in rows:
+                _pending.popleft()
+            # The tick time, not the commit time: stamping it after the write would leave
+            # the next tick a write-duration short of the flush interval
+            _last_flush = now
             DB_WRITE_SUCCESS_TOTAL.inc()
-            app.logger.info(f"Timestamp '{current_time}' written successfully to '{DB_NAME}'.")
+            # Per-write success is debug-only; DB_WRITE_SUCCESS_TOTAL tracks it
+            app.logger.debug("%d timestamp(s) up to ts_ns=%d written successfully to '%s'.", len(rows), rows[-1], DB_NAME)
 
         except Psycopg2OperationalError as e:
             # Catch PostgreSQL specific operational errors (e.g., connection issues, timeouts)
+            failed = True
             DB_WRITE_TIMEOUT_TOTAL.inc() # Treat operational errors as timeouts for this example
             DB_WRITE_FAILURE_TOTAL.inc()
             app.logger.error(f"PostgreSQL write failed (operational error/timeout): {e}")
         except Exception as e:
+            failed = True
             DB_WRITE_FAILURE_TOTAL.inc()
             app.logger.error(f"Database write failed (general error): {e}")
         finally:
-            # Ensure connection is closed even if an error occurs
-            if 'conn' in locals() and conn:
-                conn.close()
+            # Hand the connection back to the pool; discard it if the write failed
+            if conn is not None:
+                release_db_connection(conn, close=failed)
+    return not failed
 
 
 # --- Periodic Background Task ---
-def periodic_db_writer():
+# One scheduler thread runs all periodic work. Jobs re-arm themselves at fixed deadlines,
+# so time spent writing (or waiting on other threads) does not push later runs back.
+SCHEDULER = sched.scheduler(time.monotonic, time.sleep)
+
+
+def periodic_db_writer(deadline):
     """
-    Background thread function to periodically write timestamps to the database.
+    Scheduler job that writes a timestamp to the database, then re-arms itself
+    DB_WRITE_INTERVAL_SECONDS after its deadline.
     """
-    while True:
-        # In case get_db_connection() fails during startup, give it a moment
-        try:
-            write_timestamp_to_db()
-        except Exception as e:
-            app.logger.error(f"Periodic DB writer encountered a non-recoverable error during write: {e}. Retrying after interval.")
-            # Do not re-raise, allow the loop to continue and retry.
-        time.sleep(DB_WRITE_INTERVAL_SECONDS)
+    try:
+        with WRITE_LOCK:
+            write_timestamp_to_db(now=deadline)
+    except Exception as e:
+        app.logger.error(f"Periodic DB writer encountered a non-recoverable error during write: {e}. Retrying after interval.")
+        # Do not re-raise, keep the job scheduled so it retries.
+    next_run = deadline + DB_WRITE_INTERVAL_SECONDS
+    now = time.monotonic()
+    if next_run < now:
+        # Fell behind by more than an interval; skip the missed ticks instead of bursting
+        next_run = now
+    SCHEDULER.enterabs(next_run, 1, periodic_db_writer, (next_run,))
 
 # --- Flask Routes ---
 
+# Rendered /metrics body, reused for _METRICS_CACHE_TTL seconds so back-to-back scrapes
+# do not each walk and format every series.
+_METRICS_CACHE = {"body": b"", "ts": float('-inf')}
+_METRICS_CACHE_TTL = 1.0
+_METRICS_CACHE_LOCK = threading.Lock()
+
 @app.route('/')
 def health_check():
     """Simple health check endpoint."""
     app.logger.info("Health check endpoint accessed.")
     return "Flask app is running and writing timestamps!", 200
 
+@app.route('/tick', methods=['POST'])
+def tick():
+    """
+    Writes a timestamp on demand, e.g. from a Kubernetes CronJob, flushing everything pending.
+    With DB_SCHEDULED_WRITES=false this is the only way timestamps are written.
+    Returns 204 once the rows are committed, 503 if the write failed.
+    """
+    with WRITE_LOCK:
+        written = write_timestamp_to_db(force=True)
+    # A failed write surfaces as a failed request, so the CronJob's curl -f fails too
+    if not written:
+        return "Database write failed", 503
+    return '', 204
+
 @app.route('/metrics')
 def metrics():
     """
@@ -189,21 +500,46 @@ def metrics():
     Returns the latest metrics in Prometheus exposition format.
     """
     app.logger.debug("Metrics endpoint accessed by Prometheus.") # Use debug level for frequent access
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    with _METRICS_CACHE_LOCK:
+        now = time.monotonic()
+        if now - _METRICS_CACHE["ts"] > _METRICS_CACHE_TTL:
+            _METRICS_CACHE["body"] = generate_latest()
+            _METRICS_CACHE["ts"] = now
+        body = _METRICS_CACHE["body"]
+    return Response(body, mimetype=CONTENT_TYPE_LATEST)
 
 # --- Application Startup ---
-if __name__ == '__main__':
+# The app is served by gunicorn (see gunicorn.conf.py), which calls start_background_tasks()
+# once in its worker after the app is loaded.
+_BG_LOCK = threading.Lock()
+
+
+def start_background_tasks():
+    """
+    Creates the connection pool, the table and its current partitions, schedules the periodic
+    writer (unless DB_SCHEDULED_WRITES=false) and starts the scheduler thread.
+    Safe to call more than once; only the first call does anything.
+    """
+    with _BG_LOCK:
+        if app.config.get('_BG_STARTED'):
+            return
+        app.config['_BG_STARTED'] = True
+
+    start_log_listener()
+
     # Ensure the database table exists on startup
     # This assumes the connection parameters are available and correct at startup.
     app.logger.info("Starting Flask application...")
-    create_table()
+    try:
+        init_db_pool()
+    except Exception as e:
+        app.logger.error(f"Could not create the connection pool at startup, will retry on first write: {e}")
+    # Creates the table and its partitions; retried by the scheduler if the database is down
+    maintain_partitions()
 
-    # Start the background thread for periodic database writes
+    # Start the scheduler thread that runs the periodic database writes
     # Setting daemon=True ensures the thread exits when the main program exits
-    db_writer_thread = threading.Thread(target=periodic_db_writer, daemon=True)
-    db_writer_thread.start()
-
-    # Run the Flask application
-    # 0.0.0.0 makes the server accessible from outside the container
-    # Port 5000 is a common default for Flask apps
-    app.run(host='0.0.0.0', port=5000)
+    if SCHEDULED_WRITES:
+        SCHEDULER.enter(0, 1, periodic_db_writer, (time.monotonic(),))
+    scheduler_thread = threading.Thread(target=SCHEDULER.run, daemon=True, name="scheduler")
+    scheduler_thread.start()
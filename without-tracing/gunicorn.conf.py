@@ -0,0 +1,28 @@
+# gunicorn.conf.py
+
+# Gunicorn settings for the PostgreSQL timestamp writer.
+# Usage: gunicorn -c gunicorn.conf.py app:app
+
+bind = '0.0.0.0:5000'
+
+# A single worker process: the background writer and the Prometheus metrics live in
+# process memory, so more workers would duplicate writes and split the counters
+# between processes. Threads let /metrics and / be served while the writer is busy.
+workers = 1
+worker_class = 'gthread'
+threads = 8
+
+# Import the app once in the master so configuration errors fail fast at startup.
+# Nothing connects to the database or starts a thread at import time; the pool, the log
+# listener and the scheduler are all created by start_background_tasks() in the worker.
+preload_app = True
+
+# Directs access logs to stdout and error logs to stderr
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Starts the scheduler thread that runs the database writes inside the worker, after the fork."""
+    from app import start_background_tasks
+    start_background_tasks()